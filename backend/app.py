@@ -7,26 +7,54 @@ from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
+import hashlib
 import os
 import io
 from datetime import datetime
 from typing import Optional
 
 # Import our custom modules
-from cartoon_converter import CartoonConverter
-from ai_converter import AICartoonConverter
+from processing import (
+    cartoon_converter, ai_converter, configure_opencv, create_executor,
+    convert_image_bytes, convert_image_file, SUPPORTED_STYLES
+)
 from utils import (
     allowed_file, generate_unique_filename, ensure_dir_exists,
-    read_image_from_bytes, image_to_bytes, resize_image,
-    validate_image, cleanup_old_files
+    read_upload, validate_image, cleanup_old_files, LRUBytesCache
 )
 
+# Configure OpenCV: keep SIMD dispatch enabled and split the cores between
+# server worker processes (WEB_CONCURRENCY is honored by uvicorn/gunicorn)
+SERVER_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+configure_opencv(SERVER_WORKERS)
+
+# Process pool for conversions, so CPU work does not block the event loop
+CONVERT_WORKERS = max(1, int(os.getenv("CONVERT_WORKERS", str(os.cpu_count() or 1))))
+executor = None
+
+# Converted images keyed by upload content hash and options, so repeated
+# uploads skip the pipeline
+response_cache = LRUBytesCache(max_size_mb=int(os.getenv("RESPONSE_CACHE_MB", "256")))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the conversion process pool and shut it down on exit"""
+    global executor
+    executor = create_executor(CONVERT_WORKERS, SERVER_WORKERS)
+    yield
+    executor.shutdown(cancel_futures=True)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Image to Cartoon Converter API",
     description="Convert images to cartoon style using AI and image processing",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -38,10 +66,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize converters
-cartoon_converter = CartoonConverter()
-ai_converter = AICartoonConverter()
-
 # Directories
 UPLOAD_DIR = "../uploads"
 OUTPUT_DIR = "../outputs"
@@ -158,48 +182,33 @@ async def convert_image(
             detail="Invalid file type. Allowed: PNG, JPG, JPEG, GIF, BMP, WEBP"
         )
     
+    if style not in SUPPORTED_STYLES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown style: {style}. Use /api/styles to see available styles."
+        )
+    
     try:
         # Read uploaded file
-        contents = await file.read()
-        
-        # Validate image
-        is_valid, error_msg = validate_image(contents, max_size_mb=10)
-        if not is_valid:
+        contents, error_msg = await read_upload(file, max_size_mb=10)
+        if error_msg:
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # Convert bytes to image array
-        image = read_image_from_bytes(contents)
+        cache_key = hashlib.sha256(contents).digest() + f"{style}:{resize_output}".encode()
+        result_bytes = response_cache.get(cache_key)
         
-        # Resize if needed
-        if resize_output:
-            image = resize_image(image, max_size=(1920, 1080))
-        
-        # Apply cartoon conversion based on style
-        if style in ['classic', 'smooth', 'edge_heavy', 'ultra']:
-            # Use OpenCV-based converter
-            result = cartoon_converter.convert(image, style)
-            
-        elif style == 'pencil_sketch':
-            result = cartoon_converter.stylize_pencil_sketch(image, color=False)
-            
-        elif style == 'pencil_sketch_color':
-            result = cartoon_converter.stylize_pencil_sketch(image, color=True)
-            
-        elif style == 'oil_painting':
-            result = cartoon_converter.stylize_oil_painting(image)
-            
-        elif style in ['cartoon', 'anime', 'watercolor']:
-            # Use AI-based converter
-            result = ai_converter.apply_neural_style_transfer(image, style)
+        if result_bytes is None:
+            # Validate image
+            is_valid, error_msg = validate_image(contents, max_size_mb=10)
+            if not is_valid:
+                raise HTTPException(status_code=400, detail=error_msg)
             
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unknown style: {style}. Use /api/styles to see available styles."
+            # Decode, convert and encode in a worker process
+            loop = asyncio.get_running_loop()
+            result_bytes = await loop.run_in_executor(
+                executor, convert_image_bytes, contents, style, resize_output
             )
-        
-        # Convert result to bytes
-        result_bytes = image_to_bytes(result, format='JPEG')
+            response_cache.put(cache_key, result_bytes)
         
         # Return as streaming response
         return StreamingResponse(
@@ -243,58 +252,56 @@ async def batch_convert_images(
             detail="Maximum 10 files allowed in batch processing"
         )
     
-    results = []
+    # Files are converted concurrently in the process pool; the semaphore
+    # bounds how many uploads are held in memory at once
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(CONVERT_WORKERS)
     
-    for file in files:
-        try:
-            if not allowed_file(file.filename):
-                results.append({
+    async def process_file(file: UploadFile) -> dict:
+        if not allowed_file(file.filename):
+            return {
+                "filename": file.filename,
+                "status": "error",
+                "message": "Invalid file type"
+            }
+        
+        async with semaphore:
+            try:
+                contents, error_msg = await read_upload(file, max_size_mb=10)
+                if not error_msg:
+                    _, error_msg = validate_image(contents, max_size_mb=10)
+                
+                if error_msg:
+                    return {
+                        "filename": file.filename,
+                        "status": "error",
+                        "message": error_msg
+                    }
+                
+                # Save to outputs (in production, you might want to zip these)
+                unique_filename = generate_unique_filename(file.filename)
+                output_path = os.path.join(OUTPUT_DIR, unique_filename)
+                
+                # Process and save image in a worker process
+                await loop.run_in_executor(
+                    executor, convert_image_file, contents, style, output_path
+                )
+                
+                return {
                     "filename": file.filename,
-                    "status": "error",
-                    "message": "Invalid file type"
-                })
-                continue
-            
-            contents = await file.read()
-            is_valid, error_msg = validate_image(contents, max_size_mb=10)
-            
-            if not is_valid:
-                results.append({
+                    "output_filename": unique_filename,
+                    "status": "success",
+                    "style": style
+                }
+                
+            except Exception as e:
+                return {
                     "filename": file.filename,
                     "status": "error",
-                    "message": error_msg
-                })
-                continue
-            
-            # Save to outputs (in production, you might want to zip these)
-            unique_filename = generate_unique_filename(file.filename)
-            output_path = os.path.join(OUTPUT_DIR, unique_filename)
-            
-            # Process image
-            image = read_image_from_bytes(contents)
-            
-            if style in ['classic', 'smooth', 'edge_heavy']:
-                result = cartoon_converter.convert(image, style)
-            else:
-                result = ai_converter.apply_neural_style_transfer(image, style)
-            
-            # Save result
-            import cv2
-            cv2.imwrite(output_path, result)
-            
-            results.append({
-                "filename": file.filename,
-                "output_filename": unique_filename,
-                "status": "success",
-                "style": style
-            })
-            
-        except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": str(e)
-            })
+                    "message": str(e)
+                }
+    
+    results = await asyncio.gather(*[process_file(file) for file in files])
     
     return {
         "total": len(files),
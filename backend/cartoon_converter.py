@@ -3,24 +3,84 @@ Image Processing-based Cartoon Converter using OpenCV
 Implements classic cartoon effect with edge detection and color quantization
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from typing import Tuple
 
+from utils import (
+    NUMBA_AVAILABLE, apply_palette, build_palette_lut, channel_lut, nearest_center_labels
+)
+
+
+def _cuda_available() -> bool:
+    """Check for a CUDA device and the CUDA filters used by the ultra style"""
+    try:
+        return (cv2.cuda.getCudaEnabledDeviceCount() > 0
+                and hasattr(cv2.cuda, 'bilateralFilter')
+                and hasattr(cv2.cuda, 'fastNlMeansDenoisingColored'))
+    except (AttributeError, cv2.error):
+        return False
+
 
 class CartoonConverter:
     """Convert images to cartoon style using image processing techniques"""
     
     def __init__(self):
         self.default_params = {
-            'bilateral_d': 9,
-            'bilateral_sigma_color': 300,
-            'bilateral_sigma_space': 300,
+            'smooth_sigma_s': 60,  # Edge-preserving filter spatial extent
+            'smooth_sigma_r': 0.4,  # Edge-preserving filter color range (0-1)
             'median_blur_kernel': 7,
             'edge_block_size': 9,
             'edge_c': 2,
-            'color_clusters': 12  # Increased for better color detail
+            'color_clusters': 12,  # Increased for better color detail
+            'color_levels': 4,  # Levels per channel when not using K-means
+            'use_kmeans': False,  # K-means palette instead of uniform LUT levels
+            'kmeans_sample_size': 20000,  # Pixels used to fit the color clusters
+            # Seed K-means from the previous image's palette (video frames,
+            # batches of similar images). Off by default: the result would
+            # then depend on whichever image this converter processed before
+            'kmeans_warm_start': False,
+            'downscale_filter': True,  # Ultra style: smooth/quantize colors at half resolution
+            'use_nlmeans': False,  # Ultra style: non-local means denoise first (slow, for noisy photos)
+            # Ultra style on CUDA: three bilateral passes replace the recursive
+            # filter (smooth_sigma_* do not apply); d and sigma_space are in
+            # pixels and scaled with downscale_filter
+            'gpu_bilateral_d': 9,
+            'gpu_bilateral_sigma_color': 75,
+            'gpu_bilateral_sigma_space': 75
         }
+        self._rng = np.random.default_rng()
+        
+        # Run the ultra style's denoise/smoothing on the GPU when possible
+        self._gpu = _cuda_available()
+        
+        # Color quantization LUTs, built once per number of levels
+        self._level_luts = {}
+        
+        # Last K-means palette and sample mean color per k, used to warm start
+        # the next call when 'kmeans_warm_start' is on
+        self._palette_cache = {}
+        self._palette_drift = 15.0
+        
+        # Nearest-center LUTs over 32x32x32 color bins, keyed by the centers
+        self._center_luts = {}
+        
+        # Saturation/brightness boosts as 8-bit lookup tables (HSV or LAB order)
+        self._hsv_sat_12 = channel_lut(100, 120, 100)
+        self._hsv_sat_13_val_11 = channel_lut(100, 130, 110)
+        self._hsv_sat_14_val_105 = channel_lut(100, 140, 105)
+        
+        # Convolution kernels and structuring elements shared by the styles
+        self._sharpen_kernel = np.array([[0, -1, 0],
+                                         [-1, 5, -1],
+                                         [0, -1, 0]], dtype=np.float32)
+        self._se_2x2 = np.ones((2, 2), np.uint8)
+        self._se_ellipse_3 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        
+        # Runs the ultra style's independent edge detectors concurrently
+        # (OpenCV releases the GIL while filtering)
+        self._executor = ThreadPoolExecutor(max_workers=3)
     
     def convert(self, image: np.ndarray, style: str = 'classic') -> np.ndarray:
         """
@@ -49,24 +109,19 @@ class CartoonConverter:
         ENHANCED Classic cartoon effect with balanced edges and colors
         
         Process:
-        1. Apply bilateral filter for edge-preserving smoothing (multiple passes)
+        1. Apply recursive edge-preserving filter for smoothing
         2. Detect edges using adaptive thresholding
         3. Quantize colors using K-means clustering
         4. Combine edges with quantized colors
         5. Apply contrast enhancement
         """
-        # Step 1: Smooth the image while preserving edges (double pass for better quality)
-        smooth = cv2.bilateralFilter(
+        # Step 1: Smooth the image while preserving edges (domain transform
+        # recursive filter, linear in the number of pixels)
+        smooth = cv2.edgePreservingFilter(
             image,
-            d=self.default_params['bilateral_d'],
-            sigmaColor=self.default_params['bilateral_sigma_color'],
-            sigmaSpace=self.default_params['bilateral_sigma_space']
-        )
-        smooth = cv2.bilateralFilter(
-            smooth,
-            d=self.default_params['bilateral_d'],
-            sigmaColor=self.default_params['bilateral_sigma_color'],
-            sigmaSpace=self.default_params['bilateral_sigma_space']
+            flags=cv2.RECURS_FILTER,
+            sigma_s=self.default_params['smooth_sigma_s'],
+            sigma_r=self.default_params['smooth_sigma_r']
         )
         
         # Step 2: Detect edges with better quality
@@ -82,25 +137,23 @@ class CartoonConverter:
         )
         
         # Step 3: Quantize colors (reduce color palette)
-        quantized = self._quantize_colors(
+        quantized = self._reduce_colors(
             smooth,
-            k=self.default_params['color_clusters']
+            k=self.default_params['color_clusters'],
+            levels=self.default_params['color_levels']
         )
         
         # Step 4: Enhance saturation for vibrant cartoon colors
-        quantized_hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV).astype(np.float32)
-        quantized_hsv[:, :, 1] = np.clip(quantized_hsv[:, :, 1] * 1.2, 0, 255)  # Boost saturation
-        quantized = cv2.cvtColor(quantized_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+        quantized_hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV)
+        quantized_hsv = cv2.LUT(quantized_hsv, self._hsv_sat_12)  # Saturation x1.2
+        quantized = cv2.cvtColor(quantized_hsv, cv2.COLOR_HSV2BGR)
         
-        # Step 5: Combine edges with quantized colors
-        edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        cartoon = cv2.bitwise_and(quantized, edges_colored)
+        # Step 5: Combine edges with quantized colors (the edge map is used
+        # directly as a mask, no 3-channel copy of it is needed)
+        cartoon = cv2.bitwise_and(quantized, quantized, mask=edges)
         
-        # Step 6: Apply subtle sharpening for crisp results
-        kernel = np.array([[0, -1, 0],
-                          [-1, 5, -1],
-                          [0, -1, 0]])
-        cartoon = cv2.filter2D(cartoon, -1, kernel)
+        # Step 6: Apply subtle sharpening for crisp results, in place
+        cv2.filter2D(cartoon, -1, self._sharpen_kernel, dst=cartoon)
         
         return cartoon
     
@@ -108,11 +161,9 @@ class CartoonConverter:
         """
         Smoother cartoon effect with less prominent edges
         """
-        # Apply stronger bilateral filtering
-        smooth = cv2.bilateralFilter(image, d=15, sigmaColor=80, sigmaSpace=80)
-        
-        # Apply additional smoothing
-        smooth = cv2.bilateralFilter(smooth, d=9, sigmaColor=300, sigmaSpace=300)
+        # Apply stronger edge-preserving smoothing
+        smooth = cv2.edgePreservingFilter(image, flags=cv2.RECURS_FILTER,
+                                          sigma_s=80, sigma_r=0.5)
         
         # Detect edges with less sensitivity
         gray = cv2.cvtColor(smooth, cv2.COLOR_BGR2GRAY)
@@ -129,8 +180,7 @@ class CartoonConverter:
         quantized = self._quantize_colors(smooth, k=6)
         
         # Combine
-        edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        cartoon = cv2.bitwise_and(quantized, edges_colored)
+        cartoon = cv2.bitwise_and(quantized, quantized, mask=edges)
         
         return cartoon
     
@@ -160,20 +210,18 @@ class CartoonConverter:
         
         # Combine edge detection methods
         edges = cv2.bitwise_or(cv2.bitwise_not(edges_canny), edges_adaptive)
-        edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8))
+        edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, self._se_2x2)
         
         # Quantize colors with more clusters for detail
-        quantized = self._quantize_colors(smooth, k=14)
+        quantized = self._reduce_colors(smooth, k=14, levels=5)
         
         # Boost saturation and contrast
-        quantized_hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV).astype(np.float32)
-        quantized_hsv[:, :, 1] = np.clip(quantized_hsv[:, :, 1] * 1.3, 0, 255)  # Saturation
-        quantized_hsv[:, :, 2] = np.clip(quantized_hsv[:, :, 2] * 1.1, 0, 255)  # Brightness
-        quantized = cv2.cvtColor(quantized_hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+        quantized_hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV)
+        quantized_hsv = cv2.LUT(quantized_hsv, self._hsv_sat_13_val_11)  # Saturation x1.3, brightness x1.1
+        quantized = cv2.cvtColor(quantized_hsv, cv2.COLOR_HSV2BGR)
         
         # Combine
-        edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        cartoon = cv2.bitwise_and(quantized, edges_colored)
+        cartoon = cv2.bitwise_and(quantized, quantized, mask=edges)
         
         return cartoon
     
@@ -182,62 +230,70 @@ class CartoonConverter:
         ULTRA QUALITY - Best possible cartoon effect
         Uses advanced techniques for professional results
         """
-        # Step 1: Denoise with non-local means (slower but best quality)
-        denoised = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
-        
-        # Step 2: Multiple bilateral filter passes for ultra-smooth colors
-        smooth = denoised
-        for _ in range(3):
-            smooth = cv2.bilateralFilter(smooth, d=9, sigmaColor=75, sigmaSpace=75)
-        
-        # Step 3: Advanced edge detection with multiple methods
+        # Step 3 runs in the background: the three edge detectors only need
+        # the full resolution gray image and are independent of the colors
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        edge_futures = [
+            self._executor.submit(self._sobel_edges, gray),
+            self._executor.submit(self._adaptive_edges, gray),
+            self._executor.submit(self._canny_edges, gray),
+        ]
+        
+        # Colors are smoothed and quantized at half resolution (the filters
+        # dominate the cost and flat cartoon colors lose nothing); edges are
+        # still detected at full resolution
+        height, width = image.shape[:2]
+        downscale = self.default_params['downscale_filter'] and min(height, width) >= 2
+        if downscale:
+            scale = 0.5
+            color_src = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+            color_src = image
+        sigma_s = self.default_params['smooth_sigma_s'] * scale
         
-        # Sobel edges for gradient-based detection
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        sobel = np.sqrt(sobelx**2 + sobely**2)
-        sobel = np.uint8(255 * sobel / np.max(sobel))
-        _, edges_sobel = cv2.threshold(sobel, 50, 255, cv2.THRESH_BINARY_INV)
+        if self._gpu:
+            # Steps 1-2 on the GPU: non-local means and bilateral passes
+            smooth = self._ultra_smooth_gpu(color_src, scale)
+        else:
+            # Step 1: Optionally denoise with non-local means (by far the most
+            # expensive filter; step 2 already removes most noise)
+            if self.default_params['use_nlmeans']:
+                denoised = cv2.fastNlMeansDenoisingColored(color_src, None, 10, 10, 7, 21)
+            else:
+                denoised = color_src
+            
+            # Step 2: Edge-preserving smoothing for ultra-smooth colors (the
+            # recursive filter already behaves like repeated bilateral passes)
+            smooth = cv2.edgePreservingFilter(
+                denoised,
+                flags=cv2.RECURS_FILTER,
+                sigma_s=sigma_s,
+                sigma_r=self.default_params['smooth_sigma_r']
+            )
         
-        # Adaptive threshold for local edges
-        gray_blur = cv2.medianBlur(gray, 7)
-        edges_adaptive = cv2.adaptiveThreshold(
-            gray_blur, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            blockSize=11,
-            C=2
-        )
+        # Step 4: High-quality color quantization with more colors
+        quantized = self._reduce_colors(smooth, k=16, levels=6)
+        
+        # Step 5: Enhance colors for vibrant cartoon look
+        # (one HSV round-trip: V x1.05 stands in for a LAB lightness boost)
+        hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV)
+        hsv = cv2.LUT(hsv, self._hsv_sat_14_val_105)  # Strong saturation, slight brightness boost
+        quantized = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
         
-        # Canny for sharp edges
-        edges_canny = cv2.Canny(gray, 30, 100)
-        edges_canny = cv2.dilate(edges_canny, np.ones((2, 2), np.uint8), iterations=1)
-        edges_canny = cv2.bitwise_not(edges_canny)
+        if downscale:
+            quantized = cv2.resize(quantized, (width, height), interpolation=cv2.INTER_LINEAR)
         
-        # Combine all edge detection methods
+        # Step 3 (continued): combine all edge detection methods
+        edges_sobel, edges_adaptive, edges_canny = [f.result() for f in edge_futures]
         edges = cv2.bitwise_and(edges_sobel, edges_adaptive)
         edges = cv2.bitwise_and(edges, edges_canny)
         
         # Morphological operations for cleaner edges
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
-        
-        # Step 4: High-quality color quantization with more colors
-        quantized = self._quantize_colors(smooth, k=16)
-        
-        # Step 5: Enhance colors for vibrant cartoon look
-        lab = cv2.cvtColor(quantized, cv2.COLOR_BGR2LAB).astype(np.float32)
-        lab[:, :, 0] = np.clip(lab[:, :, 0] * 1.05, 0, 255)  # Slight brightness boost
-        quantized = cv2.cvtColor(lab.astype(np.uint8), cv2.COLOR_LAB2BGR)
-        
-        hsv = cv2.cvtColor(quantized, cv2.COLOR_BGR2HSV).astype(np.float32)
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1] * 1.4, 0, 255)  # Strong saturation boost
-        quantized = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+        edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, self._se_ellipse_3)
         
         # Step 6: Combine edges with quantized colors
-        edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        cartoon = cv2.bitwise_and(quantized, edges_colored)
+        cartoon = cv2.bitwise_and(quantized, quantized, mask=edges)
         
         # Step 7: Apply advanced sharpening
         gaussian = cv2.GaussianBlur(cartoon, (0, 0), 2.0)
@@ -251,6 +307,174 @@ class CartoonConverter:
         
         return cartoon
     
+    def _sobel_edges(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Gradient-based edges for the ultra style
+        
+        Args:
+            gray: Grayscale image
+            
+        Returns:
+            Edge mask (0 on edges, 255 elsewhere)
+        """
+        # 16-bit gradients are exact for 8-bit input; the normalized threshold
+        # (50 of 255 of the peak) is applied to the raw magnitude instead of
+        # rescaling the whole image
+        sobelx = cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3)
+        sobely = cv2.Sobel(gray, cv2.CV_16S, 0, 1, ksize=3)
+        sobel = cv2.magnitude(np.float32(sobelx), np.float32(sobely))
+        peak = cv2.minMaxLoc(sobel)[1]
+        threshold = 51 * peak / 255 if peak > 0 else 1.0
+        return cv2.compare(sobel, threshold, cv2.CMP_LT)
+    
+    def _adaptive_edges(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Adaptive threshold edges (local contrast) for the ultra style
+        
+        Args:
+            gray: Grayscale image
+            
+        Returns:
+            Edge mask (0 on edges, 255 elsewhere)
+        """
+        gray_blur = cv2.medianBlur(gray, 7)
+        return cv2.adaptiveThreshold(
+            gray_blur, 255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            blockSize=11,
+            C=2
+        )
+    
+    def _canny_edges(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Canny edges, slightly thickened, for the ultra style
+        
+        Args:
+            gray: Grayscale image
+            
+        Returns:
+            Edge mask (0 on edges, 255 elsewhere)
+        """
+        edges = cv2.Canny(gray, 30, 100)
+        edges = cv2.dilate(edges, self._se_2x2, iterations=1)
+        return cv2.bitwise_not(edges)
+    
+    def _ultra_smooth_gpu(self, image: np.ndarray, scale: float = 1.0) -> np.ndarray:
+        """
+        Denoise and smooth on a CUDA device for the ultra style
+        The image is uploaded once and stays on the device for all passes
+        
+        Args:
+            image: Input image (BGR)
+            scale: Resolution of image relative to the original, used to
+                scale the spatial bilateral parameters
+            
+        Returns:
+            Smoothed image
+        """
+        d = max(1, int(round(self.default_params['gpu_bilateral_d'] * scale)))
+        sigma_color = self.default_params['gpu_bilateral_sigma_color']
+        sigma_space = self.default_params['gpu_bilateral_sigma_space'] * scale
+        
+        stream = cv2.cuda_Stream()
+        gpu_image = cv2.cuda_GpuMat()
+        gpu_image.upload(image, stream)
+        
+        smooth = gpu_image
+        if self.default_params['use_nlmeans']:
+            smooth = cv2.cuda.fastNlMeansDenoisingColored(
+                smooth, 10, 10, search_window=21, block_size=7, stream=stream
+            )
+        for _ in range(3):
+            smooth = cv2.cuda.bilateralFilter(smooth, d, sigma_color, sigma_space, stream=stream)
+        
+        result = smooth.download(stream)
+        stream.waitForCompletion()
+        
+        return result
+    
+    def _reduce_colors(self, image: np.ndarray, k: int, levels: int) -> np.ndarray:
+        """
+        Reduce colors with K-means or uniform LUT levels (see 'use_kmeans')
+        
+        Args:
+            image: Input image
+            k: Number of color clusters for K-means
+            levels: Levels per channel for LUT quantization
+            
+        Returns:
+            Image with quantized colors
+        """
+        if self.default_params['use_kmeans']:
+            return self._quantize_colors(image, k=k)
+        return self._quantize_colors_lut(image, levels=levels)
+    
+    def _quantize_colors_lut(self, image: np.ndarray, levels: int = 4) -> np.ndarray:
+        """
+        Reduce the number of colors with a per-channel lookup table
+        A single vectorized pass, much cheaper than K-means
+        
+        Args:
+            image: Input image
+            levels: Number of levels per channel (2-256)
+            
+        Returns:
+            Image with quantized colors
+        """
+        lut = self._level_luts.get(levels)
+        if lut is None:
+            # Map each channel value to one of `levels` evenly spaced values
+            # spanning the full 0-255 range
+            bins = np.arange(256) * levels // 256
+            lut = (bins * 255 // (levels - 1)).astype(np.uint8)
+            self._level_luts[levels] = lut
+        
+        return cv2.LUT(image, lut)
+    
+    def _assign_labels(self, pixels: np.ndarray, centers: np.ndarray,
+                       chunk_size: int = 100000) -> np.ndarray:
+        """
+        Assign every pixel to its nearest cluster center
+        
+        Args:
+            pixels: Float32 pixel array of shape (N, 3)
+            centers: Float32 cluster centers of shape (k, 3)
+            chunk_size: Rows processed at a time to bound the distance matrix
+            
+        Returns:
+            Label array of shape (N,)
+        """
+        # |p - c|^2 = |p|^2 - 2 p.c + |c|^2 and |p|^2 does not change argmin
+        center_norms = (centers ** 2).sum(axis=1)
+        labels = np.empty(pixels.shape[0], dtype=np.intp)
+        for start in range(0, pixels.shape[0], chunk_size):
+            block = pixels[start:start + chunk_size]
+            distances = center_norms - 2 * (block @ centers.T)
+            labels[start:start + chunk_size] = np.argmin(distances, axis=1)
+        return labels
+    
+    def _center_lut(self, centers: np.ndarray) -> np.ndarray:
+        """
+        Nearest-center lookup table over 32x32x32 color bins
+        
+        Args:
+            centers: Float32 cluster centers of shape (k, 3), k <= 256
+            
+        Returns:
+            Flat uint8 index LUT from build_palette_lut (cached per palette)
+        """
+        key = centers.tobytes()
+        lut = self._center_luts.get(key)
+        if lut is None:
+            lut = build_palette_lut(centers)
+            
+            # Palettes change between images, keep only the recent ones
+            if len(self._center_luts) >= 8:
+                self._center_luts.clear()
+            self._center_luts[key] = lut
+        return lut
+    
     def _quantize_colors(self, image: np.ndarray, k: int = 8) -> np.ndarray:
         """
         Reduce the number of colors in the image using K-means clustering
@@ -264,27 +488,66 @@ class CartoonConverter:
         """
         # Reshape image to be a list of pixels
         pixels = image.reshape((-1, 3))
-        pixels = np.float32(pixels)
-        
-        # Define criteria and apply K-means
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
-        _, labels, centers = cv2.kmeans(
-            pixels,
-            k,
-            None,
-            criteria,
-            10,
-            cv2.KMEANS_RANDOM_CENTERS
-        )
+        
+        # Fit the clusters on a random subsample of the pixels (only the
+        # sample is converted to float)
+        sample_size = self.default_params['kmeans_sample_size']
+        if pixels.shape[0] > sample_size:
+            sample = np.float32(pixels[self._rng.choice(pixels.shape[0], sample_size, replace=False)])
+        else:
+            sample = np.float32(pixels)
+        
+        warm_start = self.default_params['kmeans_warm_start']
+        mean_color = sample.mean(axis=0)
+        cached = self._palette_cache.get(k) if warm_start else None
+        
+        if cached is not None and np.abs(mean_color - cached[1]).max() <= self._palette_drift:
+            # Warm start from the previous palette; a few iterations suffice
+            initial_labels = self._assign_labels(sample, cached[0]).astype(np.int32)
+            criteria = (cv2.TERM_CRITERIA_MAX_ITER, 5, 1.0)
+            _, _, centers = cv2.kmeans(
+                sample,
+                k,
+                initial_labels.reshape(-1, 1),
+                criteria,
+                1,
+                cv2.KMEANS_USE_INITIAL_LABELS
+            )
+        else:
+            # Define criteria and apply K-means (k-means++ seeding converges in a
+            # few iterations, so a single attempt is plenty for color quantization)
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+            _, _, centers = cv2.kmeans(
+                sample,
+                k,
+                None,
+                criteria,
+                1,
+                cv2.KMEANS_PP_CENTERS
+            )
+        
+        if warm_start:
+            self._palette_cache[k] = (centers, mean_color)
+        
+        # Up to 256 centers, map every pixel to its nearest center with a
+        # single gather through a LUT over 5-bit color bins
+        if k <= 256:
+            return apply_palette(image, self._center_lut(centers), np.uint8(centers))
+        
+        # Otherwise run an exact nearest-center search (the Numba kernel reads
+        # the uint8 image directly instead of a float32 copy of all pixels)
+        if NUMBA_AVAILABLE:
+            labels = nearest_center_labels(image, centers)
+        else:
+            labels = self._assign_labels(np.float32(pixels), centers)
+            labels = labels.reshape(image.shape[:2])
         
         # Convert back to 8-bit values
         centers = np.uint8(centers)
         
-        # Map each pixel to its center
-        quantized = centers[labels.flatten()]
-        
-        # Reshape back to original image shape
-        quantized = quantized.reshape(image.shape)
+        # Map each pixel to its center (indexing with a (H, W) label view
+        # yields the (H, W, 3) image directly, no flatten copy or reshape)
+        quantized = centers[labels]
         
         return quantized
     
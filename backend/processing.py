@@ -0,0 +1,126 @@
+"""
+Image conversion jobs for the API
+Runs the CPU-heavy style conversions, typically inside a process pool
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import cv2
+import numpy as np
+
+from cartoon_converter import CartoonConverter
+from ai_converter import AICartoonConverter
+from utils import NUMBA_AVAILABLE, read_image_from_bytes, image_to_bytes, resize_image
+
+if NUMBA_AVAILABLE:
+    import numba
+
+CLASSIC_STYLES = ['classic', 'smooth', 'edge_heavy', 'ultra']
+SKETCH_STYLES = ['pencil_sketch', 'pencil_sketch_color', 'oil_painting']
+AI_STYLES = ['cartoon', 'anime', 'watercolor']
+SUPPORTED_STYLES = CLASSIC_STYLES + SKETCH_STYLES + AI_STYLES
+
+# Converters are created once per process
+cartoon_converter = CartoonConverter()
+ai_converter = AICartoonConverter()
+
+
+def configure_opencv(num_processes: int = 1) -> None:
+    """
+    Enable OpenCV optimizations and share the CPU cores between processes
+    Also caps the Numba thread pool used by the parallel palette kernels
+    
+    Args:
+        num_processes: Number of processes running OpenCV concurrently
+    """
+    threads = max(1, (os.cpu_count() or 1) // max(1, num_processes))
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(threads)
+    if NUMBA_AVAILABLE:
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def create_executor(max_workers: int, server_workers: int = 1) -> ProcessPoolExecutor:
+    """
+    Create the process pool used for conversions
+    
+    Args:
+        max_workers: Number of worker processes
+        server_workers: Number of server processes sharing the machine
+        
+    Returns:
+        Process pool executor
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=configure_opencv,
+        initargs=(max_workers * server_workers,)
+    )
+
+
+def convert_style(image: np.ndarray, style: str) -> np.ndarray:
+    """
+    Apply a conversion style to an image
+    
+    Args:
+        image: Input image (BGR format)
+        style: One of SUPPORTED_STYLES
+        
+    Returns:
+        Converted image
+    """
+    if style in CLASSIC_STYLES:
+        # Use OpenCV-based converter
+        return cartoon_converter.convert(image, style)
+    elif style == 'pencil_sketch':
+        return cartoon_converter.stylize_pencil_sketch(image, color=False)
+    elif style == 'pencil_sketch_color':
+        return cartoon_converter.stylize_pencil_sketch(image, color=True)
+    elif style == 'oil_painting':
+        return cartoon_converter.stylize_oil_painting(image)
+    elif style in AI_STYLES:
+        # Use AI-based converter
+        return ai_converter.apply_neural_style_transfer(image, style)
+    
+    raise ValueError(f"Unknown style: {style}")
+
+
+def convert_image_bytes(contents: bytes, style: str, resize_output: bool = True) -> bytes:
+    """
+    Decode, convert and re-encode an uploaded image
+    Takes and returns encoded bytes so only compact data crosses processes
+    
+    Args:
+        contents: Uploaded image data
+        style: Conversion style
+        resize_output: Whether to resize large images
+        
+    Returns:
+        Converted image as JPEG bytes
+    """
+    if resize_output:
+        # Decode large JPEGs at reduced scale, then resize to fit exactly
+        image = read_image_from_bytes(contents, max_size=(1920, 1080))
+        image = resize_image(image, max_size=(1920, 1080))
+    else:
+        image = read_image_from_bytes(contents)
+    
+    result = convert_style(image, style)
+    
+    return image_to_bytes(result, format='JPEG')
+
+
+def convert_image_file(contents: bytes, style: str, output_path: str) -> None:
+    """
+    Decode and convert an uploaded image, then save it to disk
+    
+    Args:
+        contents: Uploaded image data
+        style: Conversion style
+        output_path: Where to write the converted image
+    """
+    image = read_image_from_bytes(contents)
+    result = convert_style(image, style)
+    cv2.imwrite(output_path, result)
@@ -4,12 +4,41 @@ Utility functions for the Image to Cartoon Converter
 
 import os
 import uuid
-from typing import Tuple
+from collections import OrderedDict
+from typing import Optional, Tuple
 import cv2
 import numpy as np
 from PIL import Image
 import io
 
+# Try to import PyTurboJPEG - it's optional (SIMD JPEG codec)
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY, TJSAMP_GRAY
+    turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except (ImportError, RuntimeError, OSError):
+    # Module missing, or libturbojpeg shared library not found
+    TURBOJPEG_AVAILABLE = False
+    turbo_jpeg = None
+
+# Try to import Numba - it's optional (JIT-compiled per-pixel loops)
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+
+# cv2.imdecode flags for decoding a JPEG at 1/2, 1/4 or 1/8 scale. EXIF
+# orientation is ignored so the result matches the PIL path.
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 
 def allowed_file(filename: str, allowed_extensions: set = None) -> bool:
     """
@@ -55,19 +84,77 @@ def ensure_dir_exists(directory: str) -> None:
         os.makedirs(directory)
 
 
-def read_image_from_bytes(image_bytes: bytes) -> np.ndarray:
+def fit_scale(width: int, height: int, max_size: Tuple[int, int]) -> float:
+    """
+    Scale factor that fits an image within max_size (never upscales)
+    
+    Args:
+        width: Image width
+        height: Image height
+        max_size: Maximum (width, height)
+        
+    Returns:
+        Scale factor in (0, 1]
+    """
+    max_width, max_height = max_size
+    return min(max_width / width, max_height / height, 1.0)
+
+
+def read_image_from_bytes(image_bytes: bytes,
+                          max_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
     """
     Read image from bytes
     
     Args:
         image_bytes: Image data as bytes
+        max_size: Optional (width, height) the image will be resized to fit.
+            Large JPEGs are then decoded at a reduced DCT scale (1/2, 1/4
+            or 1/8) that still covers this size, skipping most of the
+            decode work; resize_image does the final exact resize.
         
     Returns:
         Image as numpy array (BGR format for OpenCV)
     """
-    # Convert bytes to PIL Image
+    # Fast path: decode JPEG straight to BGR with libjpeg-turbo
+    if TURBOJPEG_AVAILABLE and image_bytes[:3] == JPEG_MAGIC:
+        try:
+            scaling_factor = None
+            if max_size is not None:
+                width, height = turbo_jpeg.decode_header(image_bytes)[:2]
+                scale = fit_scale(width, height, max_size)
+                for denom in (8, 4, 2):
+                    if 1.0 / denom >= scale:
+                        scaling_factor = (1, denom)
+                        break
+            return turbo_jpeg.decode(image_bytes, pixel_format=TJPF_BGR,
+                                     scaling_factor=scaling_factor)
+        except Exception:
+            pass  # e.g. CMYK JPEG, fall back to OpenCV/PIL
+    
+    # Decode straight to BGR with OpenCV (JPEG, PNG, BMP, WebP, TIFF)
+    denom = 1
+    if max_size is not None and image_bytes[:3] == JPEG_MAGIC:
+        try:
+            width, height = Image.open(io.BytesIO(image_bytes)).size
+            scale = fit_scale(width, height, max_size)
+            denom = next((d for d in (8, 4, 2) if 1.0 / d >= scale), 1)
+        except Exception:
+            pass
+    flags = _REDUCED_DECODE_FLAGS[denom] | cv2.IMREAD_IGNORE_ORIENTATION
+    image_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    if image_bgr is not None:
+        return image_bgr
+    
+    # Fall back to PIL for formats OpenCV cannot decode (e.g. GIF)
     pil_image = Image.open(io.BytesIO(image_bytes))
     
+    # Let the JPEG decoder downscale during decode (no-op for other formats)
+    if max_size is not None:
+        width, height = pil_image.size
+        scale = fit_scale(width, height, max_size)
+        if scale < 1.0:
+            pil_image.draft(None, (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+    
     # Convert RGBA to RGB if necessary
     if pil_image.mode == 'RGBA':
         pil_image = pil_image.convert('RGB')
@@ -81,29 +168,41 @@ def read_image_from_bytes(image_bytes: bytes) -> np.ndarray:
     return image_bgr
 
 
-def image_to_bytes(image: np.ndarray, format: str = 'JPEG') -> bytes:
+def image_to_bytes(image: np.ndarray, format: str = 'JPEG', quality: int = 95) -> bytes:
     """
     Convert numpy image array to bytes
     
     Args:
         image: Image as numpy array (BGR format)
         format: Output format (JPEG, PNG, etc.)
+        quality: JPEG quality (1-100)
         
     Returns:
         Image as bytes
     """
-    # Convert BGR to RGB
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Convert to PIL Image
-    pil_image = Image.fromarray(image_rgb)
-    
-    # Save to bytes
-    img_byte_arr = io.BytesIO()
-    pil_image.save(img_byte_arr, format=format, quality=95)
-    img_byte_arr.seek(0)
-    
-    return img_byte_arr.getvalue()
+    is_jpeg = format.upper() in ('JPEG', 'JPG')
+    
+    # Fast path: encode JPEG from BGR/grayscale with libjpeg-turbo
+    if TURBOJPEG_AVAILABLE and is_jpeg:
+        image = np.ascontiguousarray(image)
+        if image.ndim == 2:
+            return turbo_jpeg.encode(image[:, :, None], quality=quality,
+                                     pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+        return turbo_jpeg.encode(image, quality=quality, pixel_format=TJPF_BGR)
+    
+    # Encode directly from BGR with OpenCV (no RGB copy or PIL round-trip).
+    # Huffman optimization and progressive scans only slow down the encode
+    # of a transient HTTP response, so keep both off.
+    params = []
+    if is_jpeg:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+    success, buffer = cv2.imencode('.' + format.lower(), image, params)
+    if not success:
+        raise ValueError(f"Could not encode image as {format}")
+    
+    return buffer.tobytes()
 
 
 def resize_image(image: np.ndarray, max_size: Tuple[int, int] = (1920, 1080)) -> np.ndarray:
@@ -118,10 +217,9 @@ def resize_image(image: np.ndarray, max_size: Tuple[int, int] = (1920, 1080)) ->
         Resized image
     """
     height, width = image.shape[:2]
-    max_width, max_height = max_size
     
     # Calculate scaling factor
-    scale = min(max_width / width, max_height / height, 1.0)
+    scale = fit_scale(width, height, max_size)
     
     if scale < 1.0:
         new_width = int(width * scale)
@@ -133,6 +231,132 @@ def resize_image(image: np.ndarray, max_size: Tuple[int, int] = (1920, 1080)) ->
     return image
 
 
+def channel_lut(*percents: int) -> np.ndarray:
+    """
+    Build a per-channel 8-bit lookup table that scales and clips each channel
+    Uses integer arithmetic only, so a x1.2 boost is exactly v * 120 // 100
+    
+    Args:
+        percents: Scale for each channel in percent (100 leaves it unchanged)
+        
+    Returns:
+        Lookup table of shape (1, 256, len(percents)) for cv2.LUT
+    """
+    values = np.arange(256, dtype=np.int32)
+    return np.dstack([
+        np.minimum(values * p // 100, 255).astype(np.uint8)
+        for p in percents
+    ])
+
+
+# Centers of the 32x32x32 color bins (5 bits per channel) as a BGR image,
+# used to build nearest-palette lookup tables
+_BIN_LEVELS = np.arange(32, dtype=np.uint8) * 8 + 4
+_BIN_CENTERS = np.stack(
+    np.meshgrid(_BIN_LEVELS, _BIN_LEVELS, _BIN_LEVELS, indexing='ij'), axis=-1
+).reshape(32, 1024, 3)
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _nearest_center(image, centers, labels):
+        """Nearest center per pixel straight from the uint8 image, parallel over rows"""
+        height, width = image.shape[0], image.shape[1]
+        k = centers.shape[0]
+        for i in prange(height):
+            for j in range(width):
+                b = np.float32(image[i, j, 0])
+                g = np.float32(image[i, j, 1])
+                r = np.float32(image[i, j, 2])
+                best = 0
+                best_dist = ((b - centers[0, 0]) ** 2 + (g - centers[0, 1]) ** 2
+                             + (r - centers[0, 2]) ** 2)
+                for c in range(1, k):
+                    dist = ((b - centers[c, 0]) ** 2 + (g - centers[c, 1]) ** 2
+                            + (r - centers[c, 2]) ** 2)
+                    if dist < best_dist:
+                        best_dist = dist
+                        best = c
+                labels[i, j] = best
+    
+    @njit(parallel=True, cache=True)
+    def _paint_palette(image, lut, palette, out):
+        """Fused LUT lookup and palette write, parallel over rows"""
+        height, width = image.shape[0], image.shape[1]
+        for i in prange(height):
+            for j in range(width):
+                idx = lut[((np.int32(image[i, j, 0]) >> 3) << 10)
+                          | ((np.int32(image[i, j, 1]) >> 3) << 5)
+                          | (np.int32(image[i, j, 2]) >> 3)]
+                out[i, j, 0] = palette[idx, 0]
+                out[i, j, 1] = palette[idx, 1]
+                out[i, j, 2] = palette[idx, 2]
+
+
+def nearest_center_labels(image: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Label every pixel with the index of its nearest center (requires Numba,
+    check NUMBA_AVAILABLE first)
+    
+    Args:
+        image: Input image (3 channels, uint8)
+        centers: Float32 cluster centers of shape (k, 3)
+        
+    Returns:
+        Label array of shape (H, W); uint8 for up to 256 centers, else int32
+    """
+    k = centers.shape[0]
+    labels = np.empty(image.shape[:2], dtype=np.uint8 if k <= 256 else np.int32)
+    _nearest_center(np.ascontiguousarray(image), np.float32(centers), labels)
+    return labels
+
+
+def build_palette_lut(palette: np.ndarray) -> np.ndarray:
+    """
+    Map every 5-bit-per-channel color bin to its nearest palette entry
+    
+    Args:
+        palette: Palette colors or cluster centers as a (k, 3) array, k <= 256
+        
+    Returns:
+        Flat uint8 index LUT with 32*32*32 entries
+    """
+    centers = np.float32(palette)
+    if NUMBA_AVAILABLE:
+        labels = np.empty(_BIN_CENTERS.shape[:2], dtype=np.uint8)
+        _nearest_center(_BIN_CENTERS, centers, labels)
+        return labels.ravel()
+    
+    bins = np.float32(_BIN_CENTERS.reshape(-1, 3))
+    distances = ((bins[:, None, :] - centers[None, :, :]) ** 2).sum(axis=-1)
+    return np.argmin(distances, axis=1).astype(np.uint8)
+
+
+def apply_palette(image: np.ndarray, lut: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """
+    Quantize an image to a palette using a LUT from build_palette_lut
+    
+    Args:
+        image: Input image (3 channels, uint8)
+        lut: Flat index LUT
+        palette: Palette colors as (k, 3) uint8 array
+        
+    Returns:
+        Image with every pixel replaced by its palette color
+    """
+    if NUMBA_AVAILABLE:
+        out = np.empty_like(image)
+        _paint_palette(image, lut, palette, out)
+        return out
+    
+    idx = (image[:, :, 0] >> 3).astype(np.uint16)
+    idx <<= 5
+    idx |= image[:, :, 1] >> 3
+    idx <<= 5
+    idx |= image[:, :, 2] >> 3
+    return palette[lut[idx]]
+
+
 def cleanup_old_files(directory: str, max_age_hours: int = 24) -> int:
     """
     Clean up old files from a directory
@@ -153,25 +377,91 @@ def cleanup_old_files(directory: str, max_age_hours: int = 24) -> int:
     max_age_seconds = max_age_hours * 3600
     deleted_count = 0
     
-    for filename in os.listdir(directory):
-        if filename == '.gitkeep':
-            continue
+    # scandir entries carry the file type from the directory listing, and
+    # stat() is cached on the entry, so each file costs a single stat call
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name == '.gitkeep' or not entry.is_file(follow_symlinks=False):
+                continue
             
-        filepath = os.path.join(directory, filename)
-        
-        if os.path.isfile(filepath):
-            file_age = current_time - os.path.getmtime(filepath)
-            
-            if file_age > max_age_seconds:
-                try:
-                    os.remove(filepath)
+            try:
+                file_age = current_time - entry.stat().st_mtime
+                
+                if file_age > max_age_seconds:
+                    os.remove(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"Error deleting {filepath}: {e}")
+            except Exception as e:
+                print(f"Error deleting {entry.path}: {e}")
     
     return deleted_count
 
 
+def check_image_dimensions(width: int, height: int) -> str:
+    """
+    Check image dimensions against the allowed range
+    
+    Args:
+        width: Image width
+        height: Image height
+        
+    Returns:
+        Error message, or empty string if dimensions are valid
+    """
+    if width < 50 or height < 50:
+        return "Image dimensions too small (minimum 50x50)"
+    
+    if width > 10000 or height > 10000:
+        return "Image dimensions too large (maximum 10000x10000)"
+    
+    return ""
+
+
+async def read_upload(upload, max_size_mb: int = 10,
+                      chunk_size: int = 65536) -> Tuple[bytes, str]:
+    """
+    Read an uploaded file in chunks, rejecting bad uploads early
+    The image header is checked from the first chunk before the rest is read
+    
+    Args:
+        upload: FastAPI UploadFile
+        max_size_mb: Maximum file size in MB
+        chunk_size: Read size in bytes
+        
+    Returns:
+        Tuple of (contents, error_message); contents is empty on error
+    """
+    max_bytes = max_size_mb * 1024 * 1024
+    size_error = f"File size exceeds maximum ({max_size_mb}MB)"
+    
+    if upload.size is not None and upload.size > max_bytes:
+        return b"", size_error
+    
+    head = await upload.read(chunk_size)
+    
+    # Check dimensions from the header; if the header does not fit in the
+    # first chunk, leave it to validate_image on the full contents
+    try:
+        with Image.open(io.BytesIO(head)) as pil_image:
+            error_msg = check_image_dimensions(*pil_image.size)
+        if error_msg:
+            return b"", error_msg
+    except Exception:
+        pass
+    
+    chunks = [head]
+    total = len(head)
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            return b"", size_error
+        chunks.append(chunk)
+    
+    return b"".join(chunks), ""
+
+
 def validate_image(image_bytes: bytes, max_size_mb: int = 10) -> Tuple[bool, str]:
     """
     Validate uploaded image
@@ -193,12 +483,9 @@ def validate_image(image_bytes: bytes, max_size_mb: int = 10) -> Tuple[bool, str
         pil_image = Image.open(io.BytesIO(image_bytes))
         
         # Check image dimensions
-        width, height = pil_image.size
-        if width < 50 or height < 50:
-            return False, "Image dimensions too small (minimum 50x50)"
-        
-        if width > 10000 or height > 10000:
-            return False, "Image dimensions too large (maximum 10000x10000)"
+        error_msg = check_image_dimensions(*pil_image.size)
+        if error_msg:
+            return False, error_msg
         
         # Verify it's a valid image format
         pil_image.verify()
@@ -209,6 +496,44 @@ def validate_image(image_bytes: bytes, max_size_mb: int = 10) -> Tuple[bool, str
         return False, f"Invalid image file: {str(e)}"
 
 
+class LRUBytesCache:
+    """Least-recently-used cache of bytes values, bounded by total size"""
+    
+    def __init__(self, max_size_mb: int = 256):
+        """
+        Initialize the cache
+        
+        Args:
+            max_size_mb: Maximum total size of cached values in MB
+        """
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+    
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Return the cached value for key (marking it recently used), or None"""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+    
+    def put(self, key: bytes, value: bytes) -> None:
+        """Store a value, evicting least recently used entries to fit"""
+        if len(value) > self.max_bytes:
+            return
+        
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old)
+        
+        self._entries[key] = value
+        self.current_bytes += len(value)
+        
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+
 def create_thumbnail(image: np.ndarray, size: Tuple[int, int] = (300, 300)) -> np.ndarray:
     """
     Create a thumbnail of the image
@@ -283,6 +608,7 @@ if __name__ == "__main__":
     print("- read_image_from_bytes: Convert bytes to image array")
     print("- image_to_bytes: Convert image array to bytes")
     print("- resize_image: Resize while maintaining aspect ratio")
+    print("- read_upload: Read uploads in chunks with early rejection")
     print("- validate_image: Validate uploaded images")
     print("- cleanup_old_files: Remove old temporary files")
     print("- create_thumbnail: Generate thumbnails")
@@ -6,6 +6,10 @@ Run this to verify your installation is working correctly
 import sys
 import os
 
+# Backend modules import each other as top-level modules (the server runs
+# from the backend directory)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
 def test_imports():
     """Test if all required packages are installed"""
     print("🧪 Testing Python package imports...")